@@ -6,8 +6,12 @@ rm -r build
 # Create build directory if it doesn't exist
 mkdir -p build
 
-# Install dependencies
-uv sync
+# Install dependencies, including the gRPC transport for Pinecone when it is enabled
+if [[ "$PINECONE_USE_GRPC" == "true" ]]; then
+    uv sync --extra grpc
+else
+    uv sync
+fi
 
 # Determine OS and set appropriate lib directory case
 if [[ "$OSTYPE" == "linux-gnu"* ]]; then
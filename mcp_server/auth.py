@@ -1,8 +1,11 @@
 """Authentication module for the MCP server."""
 
+import hashlib
 import os
+import time
 import jwt
 from fastmcp.exceptions import ValidationError
+from mcp_server.cache import token_claims_cache
 
 JWT_SECRET = os.getenv("SECRET_KEY", None)
 
@@ -35,6 +38,11 @@ def validate_token(token: str) -> tuple[bool, dict]:
     if not JWT_SECRET:
         raise ValidationError("SECRET_KEY is not set")
 
+    token_digest: str = hashlib.sha256(token.encode("utf-8")).hexdigest()
+    cached_payload: dict | None = token_claims_cache.get(token_digest)
+    if cached_payload is not None:
+        return True, cached_payload
+
     try:
         payload = jwt.decode(token, JWT_SECRET, algorithms=["HS256"])
     except jwt.ExpiredSignatureError:
@@ -42,4 +50,9 @@ def validate_token(token: str) -> tuple[bool, dict]:
     except jwt.InvalidTokenError:
         return False, {}
 
+    # Never keep verified claims around longer than the token itself is valid
+    expires_at = payload.get("exp")
+    ttl: float | None = float(expires_at) - time.time() if isinstance(expires_at, (int, float)) else None
+    token_claims_cache.set(token_digest, payload, ttl)
+
     return True, payload
\ No newline at end of file
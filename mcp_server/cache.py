@@ -0,0 +1,65 @@
+"""In-memory caches that live for the lifetime of a warm container"""
+
+from collections import OrderedDict
+import os
+import threading
+import time
+from typing import Any, Hashable
+
+
+class TTLCache:
+    """Bounded LRU cache whose entries expire after a time to live"""
+
+    def __init__(self, max_size: int, ttl: float):
+        self._max_size = max_size
+        self._ttl = ttl
+        self._items: OrderedDict[Hashable, tuple[float, Any]] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        """Get a value if it is present and not expired"""
+        with self._lock:
+            entry = self._items.get(key)
+            if entry is None:
+                return default
+
+            expires_at, value = entry
+            if expires_at <= time.time():
+                del self._items[key]
+                return default
+
+            self._items.move_to_end(key)
+            return value
+
+    def set(self, key: Hashable, value: Any, ttl: float | None = None):
+        """Set a value, optionally with a shorter time to live than the default"""
+        ttl = self._ttl if ttl is None else min(ttl, self._ttl)
+        if ttl <= 0:
+            return
+
+        with self._lock:
+            self._items[key] = (time.time() + ttl, value)
+            self._items.move_to_end(key)
+            while len(self._items) > self._max_size:
+                self._items.popitem(last=False)
+
+    def invalidate(self, key: Hashable):
+        """Remove a single entry"""
+        with self._lock:
+            self._items.pop(key, None)
+
+    def clear(self):
+        """Remove all entries"""
+        with self._lock:
+            self._items.clear()
+
+
+token_claims_cache = TTLCache(
+    max_size=int(os.getenv("TOKEN_CACHE_SIZE", "1024")),
+    ttl=float(os.getenv("TOKEN_CACHE_TTL", "300"))
+)
+
+provider_credentials_cache = TTLCache(
+    max_size=int(os.getenv("PROVIDER_CREDENTIALS_CACHE_SIZE", "1024")),
+    ttl=float(os.getenv("PROVIDER_CREDENTIALS_CACHE_TTL", "300"))
+)
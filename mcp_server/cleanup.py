@@ -0,0 +1,136 @@
+"""Cleanup of expired vector store files"""
+
+from concurrent.futures import ThreadPoolExecutor
+import json
+import os
+import threading
+import time
+from mcp_server.dynamodb import DynamoDbClient
+from mcp_server.open_ai_client import OpenAIClient, get_openai_client
+from mcp_server.internal_logger import InternalLogger
+
+CLEANUP_BASE_TTL = int(os.getenv("CLEANUP_BASE_TTL", "600"))
+CLEANUP_TTL_PER_MB = int(os.getenv("CLEANUP_TTL_PER_MB", "300"))
+CLEANUP_MAX_TTL = int(os.getenv("CLEANUP_MAX_TTL", "3600"))
+CLEANUP_MAX_WORKERS = int(os.getenv("CLEANUP_MAX_WORKERS", "8"))
+CLEANUP_PAGE_SIZE = int(os.getenv("CLEANUP_PAGE_SIZE", "100"))
+CLEANUP_MAX_ITEMS_PER_SWEEP = int(os.getenv("CLEANUP_MAX_ITEMS_PER_SWEEP", "2000"))
+CLEANUP_MIN_REMAINING_MILLIS = 30 * 1000
+
+
+def get_cleanup_ttl(size_bytes: int) -> int:
+    """Get the time to live of a vector file, larger results are kept around longer"""
+    extra_ttl: int = int(size_bytes / (1024 * 1024) * CLEANUP_TTL_PER_MB)
+    return min(CLEANUP_BASE_TTL + extra_ttl, CLEANUP_MAX_TTL)
+
+
+class CleanupBuffer:
+    """Buffers cleanup registrations so that they are written with a single batch"""
+
+    def __init__(self, dynamo_db_client: DynamoDbClient | None = None):
+        self._dynamo_db_client = dynamo_db_client or DynamoDbClient()
+        self._entries: list[dict] = []
+        self._lock = threading.Lock()
+
+    def register(self, file_name: str, file_id: str, vector_store_id: str, size_bytes: int = 0):
+        """Register a vector file for deletion once its time to live has passed"""
+        with self._lock:
+            self._entries.append({
+                "details": {"file_name": file_name, "file_id": file_id, "vector_store_id": vector_store_id},
+                "delete_at": int(time.time()) + get_cleanup_ttl(size_bytes)
+            })
+
+    def flush(self):
+        """Write all buffered registrations to the cleanup table"""
+        with self._lock:
+            entries, self._entries = self._entries, []
+
+        if not entries:
+            return
+
+        InternalLogger.LogDebug(f"Flushing {len(entries)} cleanup registrations")
+        try:
+            self._dynamo_db_client.add_vector_files_to_cleanup(entries)
+        except Exception:
+            with self._lock:
+                self._entries = entries + self._entries
+            raise
+
+
+cleanup_buffer = CleanupBuffer()
+
+
+class VectorFileSweeper:
+    """Deletes vector store files whose delete_at has passed"""
+
+    def __init__(self, dynamo_db_client: DynamoDbClient | None = None, openai_client: OpenAIClient | None = None):
+        self._dynamo_db_client = dynamo_db_client or DynamoDbClient()
+        self._openai_client = openai_client or get_openai_client()
+
+    def sweep(self, now: int | None = None, context=None) -> int:
+        """
+        Delete due vector files page by page and return the number of deleted files.
+        Rows are removed right after their page is processed, so an interrupted sweep keeps its progress.
+        A sweep stops after CLEANUP_MAX_ITEMS_PER_SWEEP rows or when the Lambda is about to time out.
+        """
+        now = now or int(time.time())
+        processed: int = 0
+        deleted: int = 0
+        exclusive_start_key: dict | None = None
+
+        while processed < CLEANUP_MAX_ITEMS_PER_SWEEP:
+            if context is not None and context.get_remaining_time_in_millis() < CLEANUP_MIN_REMAINING_MILLIS:
+                InternalLogger.LogInfo("Stopping the sweep before the Lambda times out")
+                break
+
+            page_size: int = min(CLEANUP_PAGE_SIZE, CLEANUP_MAX_ITEMS_PER_SWEEP - processed)
+            due_items, exclusive_start_key = self._dynamo_db_client.get_due_cleanup_items(now, page_size, exclusive_start_key)
+            processed += len(due_items)
+
+            if due_items:
+                with ThreadPoolExecutor(max_workers=CLEANUP_MAX_WORKERS) as executor:
+                    results: list[bool] = list(executor.map(self._delete_vector_file, due_items))
+
+                deleted_items: list[dict] = [item for item, deleted_file in zip(due_items, results) if deleted_file]
+                self._dynamo_db_client.delete_cleanup_items(deleted_items)
+                deleted += len(deleted_items)
+
+            if exclusive_start_key is None:
+                break
+
+        InternalLogger.LogInfo(f"Cleaned up {deleted} of {processed} due vector files")
+        return deleted
+
+    def _delete_vector_file(self, item: dict) -> bool:
+        file_id: str | None = None
+        try:
+            details: dict = json.loads(item["details"])
+            file_id = details["file_id"]
+            vector_store_id: str | None = details.get("vector_store_id") or os.getenv("VECTOR_STORE_ID")
+
+            if vector_store_id:
+                self.__ignore_not_found(lambda: self._openai_client.delete_vector_store_file(vector_store_id, file_id))
+            self.__ignore_not_found(lambda: self._openai_client.delete_file(file_id))
+        except Exception as error: #pylint: disable=W0718
+            # A malformed row is skipped so that it does not abort the rest of the sweep
+            InternalLogger.LogError(f"Failed to clean up vector file {file_id or item}: {error}")
+            return False
+
+        return True
+
+    @staticmethod
+    def __ignore_not_found(delete):
+        try:
+            delete()
+        except Exception as error: #pylint: disable=W0718
+            if getattr(error, "status_code", None) != 404:
+                raise
+
+
+def handler(event, context):
+    """
+    Handler for the scheduled vector file sweeper.
+    """
+
+    deleted: int = VectorFileSweeper().sweep(context=context)
+    return {"deleted": deleted}
@@ -1,11 +1,13 @@
 """DynamoDB client"""
 
 import json
-import time
 import os
 from typing import List
 import boto3
 from boto3.dynamodb.conditions import Key, Attr
+from mcp_server.cache import provider_credentials_cache
+from mcp_server.filters import MessageFilter
+from mcp_server.message_body import BODY_ATTRIBUTE, BODY_CODEC_ATTRIBUTE, COMPRESSED_BODY_ATTRIBUTE, decode_message_item, get_codec
 
 class DynamoDbClient():
     """DynamoDB client"""
@@ -13,67 +15,40 @@ class DynamoDbClient():
         self._messages_table_name = os.getenv("MESSAGES_TABLE_NAME")
         self._user_providers_table_name = os.getenv("USER_PROVIDERS_TABLE_NAME")
         self._cleanup_table_name = os.getenv("CLEAN_UP_TABLE_NAME")
+        self._user_vector_stores_table_name = os.getenv("USER_VECTOR_STORES_TABLE_NAME")
+        self._cleanup_delete_at_index_name = os.getenv("CLEAN_UP_DELETE_AT_INDEX_NAME", "type-delete_at-index")
 
     def get_messages(self, hash_key: str, sender: list[str] | None = None, _from: int | None = None, _to: int | None = None) -> list[dict]:
         """Get the messages from the DynamoDB table"""
-        client = boto3.resource("dynamodb")
-        table = client.Table(self._messages_table_name)
-
-        if sender:
-            filter_expression = Attr("message_from").eq(sender[0])
-            for sender in sender[1:]:
-                filter_expression = filter_expression | Attr("message_from").eq(sender)
-        else:
-            filter_expression = None
-
-        if _from:
-            if filter_expression:
-                filter_expression = filter_expression & Attr("created_at_timestamp").gte(_from)
-            else:
-                filter_expression = Attr("created_at_timestamp").gte(_from)
-        if _to:
-            if filter_expression:
-                filter_expression = filter_expression & Attr("created_at_timestamp").lte(_to)
-            else:
-                filter_expression = Attr("created_at_timestamp").lte(_to)
+        message_filter = MessageFilter(senders=sender or None, created_after=_from, created_before=_to)
+        return self.get_user_messages_by_filter(hash_key, message_filter, max_items=None)
 
-        items: list[dict] = []
-        
-        response = table.query(
-            KeyConditionExpression=Key("email_hash ").eq(hash_key),
-            FilterExpression=filter_expression,
-            ScanIndexForward=False,
-            Limit=100
-        )
+    def get_refresh_token(self, hash_key: str) -> List[str] | str | None:
+        """Get the refresh token for the user"""
+        refresh_tokens: List[str] | None = provider_credentials_cache.get((hash_key, "GMAIL"))
 
-        items.extend(response["Items"])
+        if refresh_tokens is None:
+            client = boto3.resource("dynamodb")
+            table = client.Table(self._user_providers_table_name)
 
-        while "LastEvaluatedKey" in response:
             response = table.query(
-                KeyConditionExpression=Key("email_hash ").eq(hash_key),
-                FilterExpression=filter_expression,
-                ScanIndexForward=False,
-                Limit=100,
-                ExclusiveStartKey=response["LastEvaluatedKey"]
+                KeyConditionExpression=Key("email_hash").eq(hash_key) & Key("provider").eq("GMAIL"),
+                IndexName="email_hash-provider-index"
             )
-            items.extend(response["Items"])
 
-        return items
-    
-    def get_refresh_token(self, hash_key: str) -> List[str] | str | None:
-        """Get the refresh token for the user"""
-        client = boto3.resource("dynamodb")
-        table = client.Table(self._user_providers_table_name)
+            refresh_tokens = [json.loads(item["auth_details"])["refresh_token"] for item in response["Items"]]
 
-        response = table.query(
-            KeyConditionExpression=Key("email_hash").eq(hash_key) & Key("provider").eq("GMAIL"),
-            IndexName="email_hash-provider-index"
-        )
-
-        refresh_tokens: List[str] = [json.loads(item["auth_details"])["refresh_token"] for item in response["Items"]]
+            # Users without a linked provider are not cached so that a fresh link is picked up right away
+            if refresh_tokens:
+                provider_credentials_cache.set((hash_key, "GMAIL"), refresh_tokens)
 
         return refresh_tokens if len(refresh_tokens) > 1 else refresh_tokens[0] if refresh_tokens else None
     
+    @staticmethod
+    def invalidate_provider_credentials(hash_key: str, provider: str = "GMAIL"):
+        """Drop cached provider credentials, e.g. after the provider was relinked"""
+        provider_credentials_cache.invalidate((hash_key, provider))
+
     def get_message_item(self, email_hash: str, message_id: str) -> dict | None:
         """Get the message item from the DynamoDB table"""
         client = boto3.resource("dynamodb")
@@ -81,52 +56,179 @@ class DynamoDbClient():
 
         response = table.get_item(
             Key={"email_hash": email_hash, "message_id": message_id},
-            ProjectionExpression="message_body,message_from,message_to,message_subject,created_at_timestamp"
+            ProjectionExpression=f"{BODY_ATTRIBUTE},{COMPRESSED_BODY_ATTRIBUTE},{BODY_CODEC_ATTRIBUTE},message_from,message_to,message_subject,created_at_timestamp"
         )
 
-        return response["Item"] if "Item" in response else None
+        return decode_message_item(response["Item"]) if "Item" in response else None
+
+    def get_user_messages_by_filter(self, email_hash: str, message_filter: MessageFilter, max_items: int | None = 100) -> list[dict]:
+        """Get the user messages by filter, newest first when the created_at index is configured and otherwise in message_id order"""
+        # DynamoDB rejects BETWEEN with a lower bound above the upper one
+        if message_filter.is_empty():
+            return []
+
+        items: list[dict] = []
 
-    def get_user_messages_by_filter(self, email_hash: str, dynamo_db_filter: Attr, max_items: int = 100) -> list[dict]:
-        """Get the user messages by filter"""
-        items: list[dict] = []  
+        key_condition, index_name = message_filter.to_dynamodb_key_condition(email_hash)
+        filter_expression = message_filter.to_dynamodb_filter_expression()
+
+        query_kwargs: dict = {"KeyConditionExpression": key_condition, "ScanIndexForward": False}
+        if index_name:
+            query_kwargs["IndexName"] = index_name
+        if filter_expression is not None:
+            query_kwargs["FilterExpression"] = filter_expression
 
         dynamodb = boto3.resource('dynamodb')
         table = dynamodb.Table(self._messages_table_name)
-        response = table.query(
-            KeyConditionExpression=Key('email_hash').eq(email_hash),
-            FilterExpression=dynamo_db_filter or ""
-        )
+        response = table.query(**query_kwargs)
         items.extend(response['Items'])
 
         while response.get('LastEvaluatedKey'):
-            if len(items) >= max_items:
+            if max_items is not None and len(items) >= max_items:
                 break
 
-            response = table.query(
-                KeyConditionExpression=Key('email_hash').eq(email_hash),
-                FilterExpression=dynamo_db_filter,
-                ExclusiveStartKey=response['LastEvaluatedKey']
-            )
+            response = table.query(**query_kwargs, ExclusiveStartKey=response['LastEvaluatedKey'])
             items.extend(response['Items'])
 
-        return items
+        return [decode_message_item(item) for item in items]
 
     def get_user_messages_by_message_id(self, email_hash: str, message_id: str) -> dict | None:
         """Get the user messages by message id"""
         dynamodb = boto3.resource('dynamodb')
         table = dynamodb.Table(self._messages_table_name)
         response = table.get_item(Key={'email_hash': email_hash, 'message_id': message_id})
-        return response['Item'] if 'Item' in response else None
+        return decode_message_item(response['Item']) if 'Item' in response else None
 
-    def add_vector_file_to_cleanup(self, file_name: str, file_id: str):
-        """Add the vector file to the cleanup table so that it can be deleted after a certain time"""
+    def sample_message_bodies(self, limit: int = 1000) -> list[str]:
+        """
+        Get message bodies to train the compression dictionary on.
+        Already compressed bodies are decompressed, so a dictionary can be retrained after the backfill.
+        """
         dynamodb = boto3.resource('dynamodb')
-        table = dynamodb.Table(self._cleanup_table_name)
-        ttl_value = int(time.time()) + 600
+        table = dynamodb.Table(self._messages_table_name)
+        scan_kwargs: dict = {"ProjectionExpression": f"{BODY_ATTRIBUTE},{COMPRESSED_BODY_ATTRIBUTE},{BODY_CODEC_ATTRIBUTE}"}
+
+        bodies: list[str] = []
+        while len(bodies) < limit:
+            response = table.scan(**scan_kwargs)
+            for item in response["Items"]:
+                decoded_item: dict = decode_message_item(item)
+                if BODY_ATTRIBUTE in decoded_item:
+                    bodies.append(decoded_item[BODY_ATTRIBUTE])
+            if "LastEvaluatedKey" not in response:
+                break
+            scan_kwargs["ExclusiveStartKey"] = response["LastEvaluatedKey"]
+
+        return bodies[:limit]
+
+    def compress_message_bodies(self, segment: int = 0, total_segments: int = 1, page_size: int = 100) -> int:
+        """
+        Backfill compressed bodies for messages that still store `message_body` as a string.
+        Returns the number of migrated messages.
+        """
+        dynamodb = boto3.resource('dynamodb')
+        table = dynamodb.Table(self._messages_table_name)
+        codec = get_codec()
+
+        scan_kwargs: dict = {
+            "FilterExpression": Attr(BODY_ATTRIBUTE).exists() & Attr(COMPRESSED_BODY_ATTRIBUTE).not_exists(),
+            "Segment": segment,
+            "TotalSegments": total_segments,
+            "Limit": page_size
+        }
+
+        migrated: int = 0
+        while True:
+            response = table.scan(**scan_kwargs)
+            for item in response["Items"]:
+                try:
+                    table.update_item(
+                        Key={"email_hash": item["email_hash"], "message_id": item["message_id"]},
+                        UpdateExpression="SET #compressed = :compressed, #codec = :codec REMOVE #body",
+                        # Skip messages rewritten by the ingestion in the meantime
+                        ConditionExpression=Attr(BODY_ATTRIBUTE).eq(item[BODY_ATTRIBUTE]),
+                        ExpressionAttributeNames={
+                            "#compressed": COMPRESSED_BODY_ATTRIBUTE,
+                            "#codec": BODY_CODEC_ATTRIBUTE,
+                            "#body": BODY_ATTRIBUTE
+                        },
+                        ExpressionAttributeValues={
+                            ":compressed": codec.compress(item[BODY_ATTRIBUTE]),
+                            ":codec": codec.codec_name
+                        }
+                    )
+                    migrated += 1
+                except table.meta.client.exceptions.ConditionalCheckFailedException:
+                    continue
+
+            if "LastEvaluatedKey" not in response:
+                return migrated
+            scan_kwargs["ExclusiveStartKey"] = response["LastEvaluatedKey"]
+
+    def get_user_vector_store(self, scope_key: str) -> dict | None:
+        """Get the vector store mapped to the user or session"""
+        dynamodb = boto3.resource('dynamodb')
+        table = dynamodb.Table(self._user_vector_stores_table_name)
+        response = table.get_item(Key={"scope_key": scope_key})
+        return response["Item"] if "Item" in response else None
+
+    def put_user_vector_store(self, scope_key: str, vector_store_id: str, expires_at: int):
+        """Map the vector store to the user or session"""
+        dynamodb = boto3.resource('dynamodb')
+        table = dynamodb.Table(self._user_vector_stores_table_name)
         table.put_item(
             Item={
-                "type": "vector_file",
-                "details": json.dumps({"file_name": file_name, "file_id": file_id}),
-                "delete_at": ttl_value
+                "scope_key": scope_key,
+                "vector_store_id": vector_store_id,
+                "expires_at": expires_at
             }
         )
+
+    def add_vector_files_to_cleanup(self, entries: list[dict]):
+        """
+        Add vector files to the cleanup table so that they can be deleted after a certain time.
+        Each entry holds the file `details` and its `delete_at` timestamp.
+        """
+        if not entries:
+            return
+
+        dynamodb = boto3.resource('dynamodb')
+        table = dynamodb.Table(self._cleanup_table_name)
+        # batch_writer groups the puts into BatchWriteItem calls and resends unprocessed items
+        with table.batch_writer() as batch:
+            for entry in entries:
+                batch.put_item(
+                    Item={
+                        "type": "vector_file",
+                        "details": json.dumps(entry["details"]),
+                        "delete_at": entry["delete_at"]
+                    }
+                )
+
+    def get_due_cleanup_items(self, now: int, limit: int, exclusive_start_key: dict | None = None, item_type: str = "vector_file") -> tuple[list[dict], dict | None]:
+        """Get one page of cleanup items whose delete_at is in the past and the key to continue from"""
+        dynamodb = boto3.resource('dynamodb')
+        table = dynamodb.Table(self._cleanup_table_name)
+
+        query_kwargs: dict = {
+            "IndexName": self._cleanup_delete_at_index_name,
+            "KeyConditionExpression": Key("type").eq(item_type) & Key("delete_at").lte(now),
+            "Limit": limit
+        }
+        if exclusive_start_key:
+            query_kwargs["ExclusiveStartKey"] = exclusive_start_key
+
+        response = table.query(**query_kwargs)
+        return response["Items"], response.get("LastEvaluatedKey")
+
+    def delete_cleanup_items(self, items: list[dict]):
+        """Delete processed items from the cleanup table"""
+        if not items:
+            return
+
+        dynamodb = boto3.resource('dynamodb')
+        table = dynamodb.Table(self._cleanup_table_name)
+        key_names: list[str] = [key["AttributeName"] for key in table.key_schema]
+        with table.batch_writer(overwrite_by_pkeys=key_names) as batch:
+            for item in items:
+                batch.delete_item(Key={key_name: item[key_name] for key_name in key_names})
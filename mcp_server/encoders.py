@@ -1,8 +1,11 @@
 from decimal import Decimal
 import json
+from mcp_server.message_body import LazyMessageBody
 
 class DecimalEncoder(json.JSONEncoder):
     def default(self, obj):
         if isinstance(obj, Decimal):
             return int(obj)
+        if isinstance(obj, LazyMessageBody):
+            return str(obj)
         return super(DecimalEncoder, self).default(obj)
\ No newline at end of file
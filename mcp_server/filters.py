@@ -0,0 +1,168 @@
+"""
+Message filter shared by DynamoDB and Pinecone
+"""
+
+import os
+from typing import List, Optional
+from pydantic import BaseModel
+from boto3.dynamodb.conditions import Attr, ConditionBase, Key
+from mcp_server.models import QueryFilter
+
+CREATED_AT_ATTRIBUTE = "created_at_timestamp"
+MESSAGES_CREATED_AT_INDEX_NAME = os.getenv("MESSAGES_CREATED_AT_INDEX_NAME")
+
+# DynamoDB allows up to 100 operands for IN
+DYNAMODB_MAX_IN_OPERANDS = 100
+
+# Reasoning dates are day granular, so their bounds cover whole days
+SECONDS_PER_DAY = 24 * 60 * 60
+
+
+class MessageFilter(BaseModel):
+    """Backend independent set of predicates on a user's messages"""
+    providers: Optional[List[str]] = None
+    senders: Optional[List[str]] = None
+    recipients: Optional[List[str]] = None
+    created_after: Optional[int] = None
+    created_before: Optional[int] = None
+
+    @classmethod
+    def from_query(cls, ui_filter: QueryFilter | None = None, reasoning_filters: dict | None = None) -> "MessageFilter":
+        """Build the filter from the UI filter and the reasoning engine output, UI dates take precedence"""
+        message_filter = cls()
+
+        if reasoning_filters and isinstance(reasoning_filters.get("date"), dict):
+            created_after, created_before = _date_range_from_operators(reasoning_filters["date"])
+            message_filter = message_filter.model_copy(update={"created_after": created_after, "created_before": created_before})
+
+        if not ui_filter:
+            return message_filter
+
+        update: dict = {}
+        providers: list[str] = [inbox for inbox in ui_filter.inboxes or [] if inbox != "ALL"]
+        if providers:
+            update["providers"] = providers
+        if ui_filter.recipients:
+            update["recipients"] = ui_filter.recipients
+        if ui_filter.from_email:
+            update["senders"] = [ui_filter.from_email]
+        if ui_filter.start_date or ui_filter.end_date:
+            update["created_after"] = ui_filter.start_date_timestamp() if ui_filter.start_date else None
+            update["created_before"] = ui_filter.end_date_timestamp() if ui_filter.end_date else None
+
+        return message_filter.model_copy(update=update)
+
+    def has_date_range(self) -> bool:
+        """Whether the filter restricts the creation date"""
+        return self.created_after is not None or self.created_before is not None
+
+    def is_empty(self) -> bool:
+        """Whether the date range cannot match any message, e.g. a start after the end"""
+        return self.created_after is not None and self.created_before is not None and self.created_after > self.created_before
+
+    def to_dynamodb_key_condition(self, email_hash: str) -> tuple[ConditionBase, str | None]:
+        """
+        Compile to a key condition and the index it has to run on.
+        The date range is pushed into the key condition when the created_at index is configured.
+        """
+        key_condition: ConditionBase = Key("email_hash").eq(email_hash)
+
+        if not MESSAGES_CREATED_AT_INDEX_NAME or not self.has_date_range():
+            return key_condition, None
+
+        created_at = Key(CREATED_AT_ATTRIBUTE)
+        if self.created_after is not None and self.created_before is not None:
+            key_condition = key_condition & created_at.between(self.created_after, self.created_before)
+        elif self.created_after is not None:
+            key_condition = key_condition & created_at.gte(self.created_after)
+        else:
+            key_condition = key_condition & created_at.lte(self.created_before)
+
+        return key_condition, MESSAGES_CREATED_AT_INDEX_NAME
+
+    def to_dynamodb_filter_expression(self) -> ConditionBase | None:
+        """Compile the predicates not covered by the key condition to a filter expression"""
+        conditions: list[ConditionBase] = []
+
+        if self.providers:
+            conditions.append(_any_of([Attr("provided_key").contains(provider) for provider in self.providers]))
+
+        if self.senders:
+            conditions.append(_is_in("message_from", self.senders))
+
+        if self.recipients:
+            conditions.append(_any_of([Attr("message_to").contains(recipient) for recipient in self.recipients]))
+
+        if self.has_date_range() and not MESSAGES_CREATED_AT_INDEX_NAME:
+            created_at = Attr(CREATED_AT_ATTRIBUTE)
+            if self.created_after is not None and self.created_before is not None:
+                conditions.append(created_at.between(self.created_after, self.created_before))
+            elif self.created_after is not None:
+                conditions.append(created_at.gte(self.created_after))
+            else:
+                conditions.append(created_at.lte(self.created_before))
+
+        if not conditions:
+            return None
+
+        filter_expression: ConditionBase = conditions[0]
+        for condition in conditions[1:]:
+            filter_expression = filter_expression & condition
+        return filter_expression
+
+    def to_pinecone_filter(self) -> dict:
+        """Compile to a Pinecone metadata filter"""
+        pinecone_filter: dict = {}
+
+        if self.providers:
+            pinecone_filter["provider"] = {"$in": self.providers}
+
+        if self.recipients:
+            pinecone_filter["to"] = {"$in": self.recipients}
+
+        if self.senders:
+            pinecone_filter["from"] = {"$in": self.senders}
+
+        date_filter: dict = {}
+        if self.created_after is not None:
+            date_filter["$gte"] = self.created_after
+        if self.created_before is not None:
+            date_filter["$lte"] = self.created_before
+        if date_filter:
+            pinecone_filter["date"] = date_filter
+
+        return pinecone_filter
+
+
+def _date_range_from_operators(date_operators: dict) -> tuple[int | None, int | None]:
+    """
+    Each value is the start of a day, so bounds are widened to whole days.
+    When several operators bound the same side the tightest one wins, whatever their order.
+    """
+    lower_bounds: list[int] = []
+    upper_bounds: list[int] = []
+
+    for operator, value in date_operators.items():
+        day_start = int(value)
+        if operator in ("$gte", "$eq"):
+            lower_bounds.append(day_start)
+        if operator in ("$lte", "$eq"):
+            upper_bounds.append(day_start + SECONDS_PER_DAY - 1)
+        if operator == "$gt":
+            lower_bounds.append(day_start + SECONDS_PER_DAY)
+        if operator == "$lt":
+            upper_bounds.append(day_start - 1)
+
+    return max(lower_bounds, default=None), min(upper_bounds, default=None)
+
+
+def _is_in(attribute: str, values: list[str]) -> ConditionBase:
+    chunks = [values[i:i + DYNAMODB_MAX_IN_OPERANDS] for i in range(0, len(values), DYNAMODB_MAX_IN_OPERANDS)]
+    return _any_of([Attr(attribute).is_in(chunk) for chunk in chunks])
+
+
+def _any_of(conditions: list[ConditionBase]) -> ConditionBase:
+    condition: ConditionBase = conditions[0]
+    for other in conditions[1:]:
+        condition = condition | other
+    return condition
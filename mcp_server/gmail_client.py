@@ -0,0 +1,240 @@
+"""Gmail request layer with batching and per-user rate limiting"""
+
+import os
+import random
+import threading
+import time
+from typing import Any, Dict, List
+from googleapiclient.errors import HttpError
+from googleapiclient.http import HttpRequest
+from googleapiclient.discovery import Resource
+from mcp_server.cache import TTLCache
+from mcp_server.internal_logger import InternalLogger
+
+# Gmail allows 250 quota units per user per second
+GMAIL_QUOTA_UNITS_PER_SECOND = float(os.getenv("GMAIL_QUOTA_UNITS_PER_SECOND", "250"))
+GMAIL_BATCH_SIZE = 100
+GMAIL_MAX_RETRIES = int(os.getenv("GMAIL_MAX_RETRIES", "5"))
+
+RATE_LIMIT_REASONS = ("rateLimitExceeded", "userRateLimitExceeded", "quotaExceeded")
+RETRYABLE_STATUSES = (429, 500, 502, 503, 504)
+
+gmail_quota_costs: Dict[str, int] = {
+    "gmail.users.messages.get": 5,
+    "gmail.users.messages.list": 5,
+    "gmail.users.messages.modify": 5,
+    "gmail.users.messages.batchModify": 50,
+    "gmail.users.messages.batchDelete": 50,
+    "gmail.users.history.list": 2,
+    "gmail.users.labels.list": 1,
+}
+default_quota_cost = 5
+
+
+class GmailBatchError(Exception):
+    """Raised when some requests of a batch failed permanently"""
+
+    def __init__(self, results: List[Any], errors: Dict[int, Exception]):
+        self.results = results
+        self.errors = errors
+        super().__init__(f"{len(errors)} of {len(results)} Gmail batch requests failed")
+
+
+class AdaptiveRateLimiter:
+    """Token bucket limiter that backs off when Gmail reports rate limiting"""
+
+    def __init__(self, rate: float = GMAIL_QUOTA_UNITS_PER_SECOND, min_rate: float = 10.0):
+        self._max_rate = rate
+        self._min_rate = min_rate
+        self._rate = rate
+        self._tokens = rate
+        self._updated_at = time.monotonic()
+        self._blocked_until = 0.0
+        self._lock = threading.Lock()
+
+    @property
+    def rate(self) -> float:
+        """Current refill rate in quota units per second"""
+        return self._rate
+
+    def acquire(self, cost: float):
+        """
+        Block until `cost` quota units are available.
+        A cost above the bucket capacity is taken once the bucket is full and leaves it in debt,
+        so later calls wait until the whole cost has been paid back.
+        """
+        required: float = min(cost, self._max_rate)
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._refill(now)
+                wait = max(self._blocked_until - now, 0.0)
+                if wait == 0.0 and self._tokens >= required:
+                    self._tokens -= cost
+                    return
+                if wait == 0.0:
+                    wait = (required - self._tokens) / self._rate
+            time.sleep(wait)
+
+    def on_success(self):
+        """Slowly recover the rate after successful calls"""
+        with self._lock:
+            self._rate = min(self._rate * 1.1, self._max_rate)
+
+    def on_rate_limited(self, retry_after: float | None = None):
+        """Halve the rate and pause the bucket after a rate limit response"""
+        with self._lock:
+            self._rate = max(self._rate / 2, self._min_rate)
+            self._tokens = min(self._tokens, 0.0)
+            pause = retry_after if retry_after is not None else 1.0
+            self._blocked_until = max(self._blocked_until, time.monotonic() + pause)
+            InternalLogger.LogDebug(f"Gmail rate limited, new rate {self._rate} units/s, pausing {pause}s")
+
+    def _refill(self, now: float):
+        self._tokens = min(self._tokens + (now - self._updated_at) * self._rate, self._max_rate)
+        self._updated_at = now
+
+
+# Idle accounts are evicted so the registry stays bounded in long lived containers
+_limiters = TTLCache(max_size=1024, ttl=3600)
+_limiters_lock = threading.Lock()
+
+
+def get_rate_limiter(email_hash: str) -> AdaptiveRateLimiter:
+    """Get the rate limiter shared by all requests of one user, whichever refresh token they use"""
+    with _limiters_lock:
+        limiter: AdaptiveRateLimiter | None = _limiters.get(email_hash)
+        if limiter is None:
+            limiter = AdaptiveRateLimiter()
+        # Setting again on every use keeps active users from expiring
+        _limiters.set(email_hash, limiter)
+        return limiter
+
+
+class GmailRequestExecutor:
+    """Executes Gmail API requests individually or in batches with retries"""
+
+    def __init__(self, gmail_client: Resource, rate_limiter: AdaptiveRateLimiter):
+        self._gmail_client = gmail_client
+        self._rate_limiter = rate_limiter
+
+    def execute(self, request: HttpRequest) -> Any:
+        """Execute a single request"""
+        for attempt in range(GMAIL_MAX_RETRIES + 1):
+            self._rate_limiter.acquire(self.__get_cost(request))
+            try:
+                response = request.execute()
+            except HttpError as error:
+                if attempt == GMAIL_MAX_RETRIES or not self.__handle_retryable(error, attempt):
+                    raise
+                continue
+
+            self._rate_limiter.on_success()
+            return response
+
+    def execute_batch(self, requests: List[HttpRequest]) -> List[Any]:
+        """
+        Execute requests in batches of up to 100, retrying rate limited ones.
+        Results are returned in the order of `requests`.
+        Raises GmailBatchError carrying the partial results if any request failed permanently.
+        """
+        results: List[Any] = [None] * len(requests)
+        errors: Dict[int, Exception] = {}
+
+        for start in range(0, len(requests), GMAIL_BATCH_SIZE):
+            pending: List[int] = list(range(start, min(start + GMAIL_BATCH_SIZE, len(requests))))
+            attempt = 0
+            while pending:
+                failed: Dict[int, Exception] = self.__execute_chunk(requests, pending, results)
+                retryable: List[int] = [
+                    index for index, error in failed.items()
+                    if attempt < GMAIL_MAX_RETRIES and self.__is_retryable(error)
+                ]
+                for index, error in failed.items():
+                    if index not in retryable:
+                        errors[index] = error
+
+                if retryable:
+                    self.__backoff(failed[retryable[0]], attempt)
+                pending = retryable
+                attempt += 1
+
+        if errors:
+            InternalLogger.LogError(f"{len(errors)} of {len(requests)} Gmail batch requests failed")
+            raise GmailBatchError(results, errors)
+
+        return results
+
+    def __execute_chunk(self, requests: List[HttpRequest], indexes: List[int], results: List[Any]) -> Dict[int, Exception]:
+        failed: Dict[int, Exception] = {}
+
+        def callback(request_id: str, response: Any, exception: Exception | None):
+            index = int(request_id)
+            if exception is not None:
+                failed[index] = exception
+            else:
+                results[index] = response
+
+        for attempt in range(GMAIL_MAX_RETRIES + 1):
+            #pylint: disable=E1101
+            batch = self._gmail_client.new_batch_http_request(callback=callback)
+            for index in indexes:
+                batch.add(requests[index], request_id=str(index))
+
+            self._rate_limiter.acquire(sum(self.__get_cost(requests[index]) for index in indexes))
+            try:
+                batch.execute()
+                break
+            except HttpError as error:
+                # The batch request itself was rejected, none of its parts ran
+                if attempt == GMAIL_MAX_RETRIES or not self.__handle_retryable(error, attempt):
+                    raise
+                failed.clear()
+
+        if not any(self.__is_rate_limited(error) for error in failed.values()):
+            self._rate_limiter.on_success()
+
+        return failed
+
+    def __handle_retryable(self, error: HttpError, attempt: int) -> bool:
+        if not self.__is_retryable(error):
+            return False
+        self.__backoff(error, attempt)
+        return True
+
+    def __backoff(self, error: Exception, attempt: int):
+        retry_after: float | None = self.__get_retry_after(error)
+        if self.__is_rate_limited(error):
+            self._rate_limiter.on_rate_limited(retry_after)
+            return
+        time.sleep(retry_after if retry_after is not None else min(2 ** attempt + random.random(), 32))
+
+    @staticmethod
+    def __is_rate_limited(error: Exception) -> bool:
+        if not isinstance(error, HttpError):
+            return False
+        if error.resp.status == 429:
+            return True
+        if error.resp.status != 403:
+            return False
+        details = error.error_details if isinstance(error.error_details, list) else []
+        return any(isinstance(detail, dict) and detail.get("reason") in RATE_LIMIT_REASONS for detail in details) \
+            or any(reason in str(error.content) for reason in RATE_LIMIT_REASONS)
+
+    def __is_retryable(self, error: Exception) -> bool:
+        if not isinstance(error, HttpError):
+            return False
+        return error.resp.status in RETRYABLE_STATUSES or self.__is_rate_limited(error)
+
+    @staticmethod
+    def __get_retry_after(error: Exception) -> float | None:
+        if not isinstance(error, HttpError):
+            return None
+        try:
+            return float(error.resp.get("retry-after"))
+        except (TypeError, ValueError):
+            return None
+
+    @staticmethod
+    def __get_cost(request: HttpRequest) -> int:
+        return gmail_quota_costs.get(getattr(request, "methodId", None), default_quota_cost)
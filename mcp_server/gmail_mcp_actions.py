@@ -8,8 +8,8 @@ import time
 from typing import Any, Dict, List
 from googleapiclient.discovery import build, Resource
 from google.oauth2.credentials import Credentials
+from openai import NotFoundError
 from openai.types.vector_stores import VectorStoreFile
-from boto3.dynamodb.conditions import Attr
 #pylint: disable=E0611
 from pinecone import QueryResponse
 from mcp_server.encoders import DecimalEncoder
@@ -18,25 +18,36 @@ from mcp_server.typings import VectorStoreAttributes
 from mcp_server.pinecone_client import PineconeClient
 from mcp_server.reasoning_engine import ReasoningEngine
 from mcp_server.models import QueryFilter
-from mcp_server.open_ai_client import OpenAIClient
+from mcp_server.filters import MessageFilter
+from mcp_server.open_ai_client import OpenAIClient, get_openai_client
+from mcp_server.vector_store_manager import VectorStoreManager
 from mcp_server.internal_logger import InternalLogger
+from mcp_server.cleanup import cleanup_buffer
+from mcp_server.gmail_client import GmailBatchError, GmailRequestExecutor, get_rate_limiter
 
 client_secret = os.getenv("GOOGLE_CLIENT_SECRET")
 client_id = os.getenv("GOOGLE_CLIENT_ID")
 
+# Gmail accepts up to 1000 ids per batchDelete call
+BATCH_DELETE_MAX_IDS = 1000
+
 
 type MCPDictListResponse = List[Dict[str, Any]]
 
 class MCPAction(ABC):
     """Base class for all MCP actions"""
     gmail_client: Resource
+    gmail_executor: GmailRequestExecutor
 
-    def __init__(self, refresh_token: str | None = None):
+    def __init__(self, refresh_token: str | None = None, email_hash: str | None = None):
         if refresh_token is None:
             return
-        
+
+        assert email_hash is not None, "email_hash is required"
+
         authorized_user_creds: Credentials = Credentials.from_authorized_user_info(self.__build_authorized_user_info(refresh_token))
         self.gmail_client = build("gmail", "v1", credentials=authorized_user_creds)
+        self.gmail_executor = GmailRequestExecutor(self.gmail_client, get_rate_limiter(email_hash))
 
     @abstractmethod
     def execute[T](self, **kwargs: Any) -> T:
@@ -60,8 +71,16 @@ class DeleteMessages(MCPAction):
         if not message_ids:
             return 0
         
+        chunks: list[list[str]] = [message_ids[i:i + BATCH_DELETE_MAX_IDS] for i in range(0, len(message_ids), BATCH_DELETE_MAX_IDS)]
         #pylint: disable=E1101
-        self.gmail_client.users().messages().batchDelete(userId="me", body={"ids": message_ids}).execute()
+        requests = [self.gmail_client.users().messages().batchDelete(userId="me", body={"ids": chunk}) for chunk in chunks]
+
+        try:
+            self.gmail_executor.execute_batch(requests)
+        except GmailBatchError as error:
+            failed_count: int = sum(len(chunks[index]) for index in error.errors)
+            InternalLogger.LogError(f"Failed to delete {failed_count} of {len(message_ids)} messages: {error.errors}")
+            return len(message_ids) - failed_count
 
         return len(message_ids)
     
@@ -69,8 +88,10 @@ class DeleteMessages(MCPAction):
 class GetUnreadMessages(MCPAction):
     """Get unread messages from the user's inbox"""
 
-    __openai_client: OpenAIClient = OpenAIClient()
+    __openai_client: OpenAIClient = get_openai_client()
     __dynamo_db_client: DynamoDbClient = DynamoDbClient()
+    __vector_store_manager: VectorStoreManager = VectorStoreManager()
+    vector_store_id: str | None = None
 
     def execute[T](self, **kwargs: Any) -> T:
         from_date = kwargs.get("from_date")
@@ -85,7 +106,9 @@ class GetUnreadMessages(MCPAction):
         InternalLogger.LogDebug(f"Getting unread messages from {_from}")
 
         #pylint: disable=E1101
-        gmail_response = self.gmail_client.users().messages().list(userId="me", q=f"is:unread after:{_from}", maxResults=20).execute()
+        gmail_response = self.gmail_executor.execute(
+            self.gmail_client.users().messages().list(userId="me", q=f"is:unread after:{_from}", maxResults=20)
+        )
 
         messages: list[dict] = gmail_response["messages"] if "messages" in gmail_response else []
         unread_messages: list[dict] = []
@@ -102,41 +125,56 @@ class GetUnreadMessages(MCPAction):
         
         return unread_messages
 
-    def upload_to_vector_store(self, unread_messages: list[dict], request_id: str):
-        """Upload unread messages to the vector store"""
+    def upload_to_vector_store(self, unread_messages: list[dict], request_id: str, email_hash: str) -> str:
+        """Upload unread messages to the user's vector store and return its id"""
 
-        vector_store_id: str = os.getenv("VECTOR_STORE_ID")
-        assert vector_store_id is not None, "VECTOR_STORE_ID is not set"
         assert request_id is not None, "request_id is required"
+        assert email_hash is not None, "email_hash is required"
         assert unread_messages is not None and len(unread_messages) > 0, "unread_messages is required"
 
         InternalLogger.LogDebug(f"Uploading {len(unread_messages)} unread messages to the vector store")
 
+        vector_store_id: str = self.__vector_store_manager.get_vector_store_id(email_hash)
+
         InternalLogger.LogDebug("Creating file in OpenAI")
 
         vector_file_name: str = f"{request_id}.json"
+        vector_file_content: bytes = json.dumps(unread_messages, cls=DecimalEncoder).encode("utf-8")
         file_id: str = self.__openai_client.upload_vector_store_file(
-            file=(vector_file_name, io.BytesIO(json.dumps(unread_messages, cls=DecimalEncoder).encode("utf-8")), "application/json"),
+            file=(vector_file_name, io.BytesIO(vector_file_content), "application/json"),
             purpose="user_data"
         ).id
 
         InternalLogger.LogDebug("File created in OpenAI")
 
+        # Registered right away so the file is cleaned up even if attaching it fails
+        cleanup_buffer.register(vector_file_name, file_id, vector_store_id, len(vector_file_content))
+
         attributes: VectorStoreAttributes = {"request_id": request_id}
 
-        InternalLogger.LogDebug("Creating vector store file in OpenAI")
-        file_id: str = self.__openai_client.create_vector_store_file(
-            vector_store_id=vector_store_id,
-            file_id=file_id,
-            attributes=attributes
-        ).id
+        InternalLogger.LogDebug(f"Creating vector store file in OpenAI vector store {vector_store_id}")
+        try:
+            file_id: str = self.__openai_client.create_vector_store_file(
+                vector_store_id=vector_store_id,
+                file_id=file_id,
+                attributes=attributes
+            ).id
+        except NotFoundError:
+            InternalLogger.LogDebug(f"Vector store {vector_store_id} no longer exists, creating a new one")
+            vector_store_id = self.__vector_store_manager.recreate_vector_store(email_hash)
+            file_id: str = self.__openai_client.create_vector_store_file(
+                vector_store_id=vector_store_id,
+                file_id=file_id,
+                attributes=attributes
+            ).id
 
         InternalLogger.LogDebug(f"Vector store file created in OpenAI: {file_id}")
 
-        self.__dynamo_db_client.add_vector_file_to_cleanup(vector_file_name, file_id)
-
         self.wait_for_file_to_be_ready(file_id, vector_store_id)
 
+        self.vector_store_id = vector_store_id
+        return vector_store_id
+
     def wait_for_file_to_be_ready(self, file_id: str, vector_store_id: str):
         """Wait for the file to be ready"""
 
@@ -184,7 +222,8 @@ class QueryMessages(GetUnreadMessages):
 
         InternalLogger.LogDebug(f"Found {len(messages)} messages for {query_str} for {email_hash} with request_id {request_id}")
 
-        self.upload_to_vector_store(messages, request_id)
+        if len(messages) > 0:
+            self.upload_to_vector_store(messages, request_id, email_hash)
 
         return messages
 
@@ -199,35 +238,37 @@ class QueryMessages(GetUnreadMessages):
 
         InternalLogger.LogDebug(f"Is filtering by date: {is_filtering_by_date}")
 
+        message_filter: MessageFilter = MessageFilter.from_query(ui_filter, reasoning_filters if is_filtering_by_date else None)
+
+        InternalLogger.LogDebug(f"Message filter: {message_filter}")
+
         if is_filtering_by_date:
-            return self._process_date_related_query(email_hash, query, ui_filter, reasoning_filters)
+            return self._process_date_related_query(email_hash, query, message_filter, reasoning_filters)
         
-        return  self._process_non_date_related_query(email_hash, query, ui_filter)
+        return  self._process_non_date_related_query(email_hash, query, message_filter)
 
 
-    def _process_date_related_query(self, email_hash: str, query: str, ui_filter: QueryFilter | None, reasoning_filters: dict) -> List[dict]:
+    def _process_date_related_query(self, email_hash: str, query: str, message_filter: MessageFilter, reasoning_filters: dict) -> List[dict]:
         InternalLogger.LogDebug(f"Processing date related query for {query} for {email_hash}")
 
-        dynamo_db_filter: Attr = self.__reasoning_engine.convert_pinecone_filter_to_dynamodb_filter(reasoning_filters, ui_filter)
-        InternalLogger.LogDebug(f"DynamoDB filter: {dynamo_db_filter}")
-
-        user_messages: list[dict] = self.__dynamo_db_client.get_user_messages_by_filter(email_hash, dynamo_db_filter)
+        user_messages: list[dict] = self.__dynamo_db_client.get_user_messages_by_filter(email_hash, message_filter)
 
         InternalLogger.LogDebug(f"Found {len(user_messages)} user messages for {query} for {email_hash}")
 
         filtered_user_messages: list[dict] = []
-        if reasoning_filters.get("is_asking_about_specific_details", False):
+        if reasoning_filters.get("is_asking_about_specific_details", False) and len(user_messages) > 0:
             InternalLogger.LogDebug("Asking about specific details")
 
-            filtered_user_messages: QueryResponse = self.__pinecone_client.search(
+            matches: list = self.__pinecone_client.search_in_ids(
                 "onboarding",
                 email_hash,
                 query,
-                additional_filters=self._build_pinecone_filter(list(map(lambda x: x["message_id"], user_messages)), ui_filter),
+                list(map(lambda x: x["message_id"], user_messages)),
+                additional_filters=message_filter.to_pinecone_filter(),
                 top_k=len(user_messages)
             )
 
-            filtered_user_messages = [match.id for match in filtered_user_messages.matches]
+            filtered_user_messages = [match.id for match in matches]
 
             InternalLogger.LogDebug(f"Filtered user messages: {filtered_user_messages}")
 
@@ -237,37 +278,11 @@ class QueryMessages(GetUnreadMessages):
 
         return user_messages
 
-    def _process_non_date_related_query(self, email_hash: str, query: str, ui_filter: QueryFilter | None) -> List[dict]:
+    def _process_non_date_related_query(self, email_hash: str, query: str, message_filter: MessageFilter) -> List[dict]:
         InternalLogger.LogDebug(f"Processing non date related query for {query} for {email_hash}")
 
-        filtered_user_messages: QueryResponse = self.__pinecone_client.search("onboarding", email_hash, query, additional_filters=self._build_pinecone_filter([], ui_filter))
+        filtered_user_messages: QueryResponse = self.__pinecone_client.search("onboarding", email_hash, query, additional_filters=message_filter.to_pinecone_filter())
         vector_ids = [match.id for match in filtered_user_messages.matches]
         InternalLogger.LogDebug(f"Vector IDs: {vector_ids}")
 
         return  [self.__dynamo_db_client.get_user_messages_by_message_id(email_hash, vector_id) for vector_id in vector_ids]
-
-    def _build_pinecone_filter(self, vector_ids: list[str], ui_filter: QueryFilter | None) -> dict:
-        filter: dict = {}
-        
-        if len(vector_ids) > 0:
-            filter["vector_id"] = {"$in": vector_ids}
-
-        if not ui_filter:
-            return filter
-        
-        if ui_filter.inboxes:
-            filter["provider"] = {"$in": ui_filter.inboxes}
-
-        if ui_filter.recipients:
-            filter["to"] = {"$in": ui_filter.recipients}
-
-        if ui_filter.from_email:
-            filter["from"] = {"$in": ui_filter.from_email}
-
-        if ui_filter.start_date:
-            filter["date"] = {"$gte": ui_filter.start_date_timestamp()}
-
-        if ui_filter.end_date:
-            filter["date"] = {"$lte": ui_filter.end_date_timestamp()}
-
-        return filter
\ No newline at end of file
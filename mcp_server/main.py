@@ -3,7 +3,9 @@
 from typing import Dict, List, Literal
 
 from awslabs.mcp_lambda_handler import MCPLambdaHandler
+from google.auth.exceptions import RefreshError
 from mcp_server.auth import get_auth
+from mcp_server.cleanup import cleanup_buffer
 from mcp_server.dynamodb import DynamoDbClient
 from mcp_server.gmail_mcp_actions import DeleteMessages, GetUnreadMessages, MCPAction, QueryMessages
 from mcp_server.session_store import get_session_store
@@ -40,7 +42,7 @@ def delete_messages_tool(sender: list[str] | None = None, from_date: int | None
     InternalLogger.LogDebug(f"Deleting messages from {sender} from {from_date} to {to_date}")
     messages: list[dict] = DynamoDbClient().get_messages(authorized_user["email_hash"], sender, from_date, to_date)
 
-    action_executor: MCPAction = mcp_actions["delete_messages"](authorized_user["refresh_token"])
+    action_executor: MCPAction = mcp_actions["delete_messages"](authorized_user["refresh_token"], authorized_user["email_hash"])
 
     return action_executor.execute(message_ids=[message["message_id"] for message in messages])
 
@@ -59,21 +61,33 @@ def get_unread_messages_tool(from_date: int | None = None):
 
     InternalLogger.LogDebug(f"Getting unread messages from {from_date}")
 
+    try:
+        unread_messages, action_executor = _get_unread_messages(from_date)
+    except RefreshError:
+        # The provider was most likely relinked, so retry once with the current refresh token
+        DynamoDbClient.invalidate_provider_credentials(authorized_user["email_hash"])
+        unread_messages, action_executor = _get_unread_messages(from_date)
+
+    if len(unread_messages) == 0:
+        return "No unread messages found"
+
+    vector_store_id: str = action_executor.upload_to_vector_store(unread_messages, request_id, authorized_user["email_hash"])
+
+    return f"Now use file_search tool on vector store {vector_store_id} to retrieve the messages. The file contains the unread messages."
+
+
+def _get_unread_messages(from_date: int | None) -> tuple[List[dict], MCPAction | None]:
     refresh_tokens: str | List[str] | None = DynamoDbClient().get_refresh_token(authorized_user["email_hash"])
-    if isinstance(refresh_tokens, list):
-        unread_messages: List[str] = []
-        for refresh_token in refresh_tokens:
-            action_executor: MCPAction = mcp_actions["get_unread_messages"](refresh_token)
-            unread_messages.extend(action_executor.execute(from_date=from_date, email_hash=authorized_user["email_hash"]))
-    
     if isinstance(refresh_tokens, str):
-        action_executor: MCPAction = mcp_actions["get_unread_messages"](refresh_tokens)
-        unread_messages: List[str] = action_executor.execute(from_date=from_date, email_hash=authorized_user["email_hash"])
+        refresh_tokens = [refresh_tokens]
 
-    if len(unread_messages) > 0:
-        action_executor.upload_to_vector_store(unread_messages, request_id)
+    unread_messages: List[dict] = []
+    action_executor: MCPAction | None = None
+    for refresh_token in refresh_tokens or []:
+        action_executor = mcp_actions["get_unread_messages"](refresh_token, authorized_user["email_hash"])
+        unread_messages.extend(action_executor.execute(from_date=from_date, email_hash=authorized_user["email_hash"]))
 
-    return "Now use file_search tool to retrieve the messages. The file contains the unread messages." if len(unread_messages) > 0 else "No unread messages found"
+    return unread_messages, action_executor
 
 
 @mcp.tool()
@@ -91,7 +105,10 @@ def query_messages_tool(query: str):
 
     action_executor: MCPAction = mcp_actions["query_messages"]()
     messages: List[dict] = action_executor.execute(query=query, email_hash=authorized_user["email_hash"], request_id=request_id)
-    return "Now use file_search tool to retrieve the messages. The file contains the all messages for provided query." if len(messages) > 0 else "No messages found"
+    if len(messages) == 0:
+        return "No messages found"
+
+    return f"Now use file_search tool on vector store {action_executor.vector_store_id} to retrieve the messages. The file contains the all messages for provided query."
 
 def handler(event, context):
     """
@@ -106,4 +123,11 @@ def handler(event, context):
     InternalLogger.LogDebug(f"Request ID: {request_id}")
 
     authorized_user, request_id = get_auth(event)
-    return mcp.handle_request(event, context)
+    try:
+        return mcp.handle_request(event, context)
+    finally:
+        try:
+            cleanup_buffer.flush()
+        except Exception as error: #pylint: disable=W0718
+            # Registrations stay buffered and are retried on the next invocation
+            InternalLogger.LogError(f"Failed to flush cleanup registrations: {error}")
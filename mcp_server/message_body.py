@@ -0,0 +1,219 @@
+"""Compression of message bodies stored in DynamoDB"""
+
+from collections import Counter
+import hashlib
+import os
+import threading
+import zlib
+from typing import Any, Iterable, Iterator
+
+COMPRESSED_BODY_ATTRIBUTE = "message_body_compressed"
+BODY_CODEC_ATTRIBUTE = "message_body_codec"
+BODY_ATTRIBUTE = "message_body"
+
+# zlib only looks back 32 KB, so a larger preset dictionary is never used
+ZLIB_MAX_DICTIONARY_SIZE = 32 * 1024
+
+# Every dictionary ever used for compression is kept in this directory as <id>.dict.
+# Items store the id of their dictionary, so a dictionary must never be removed while items still reference it.
+MESSAGE_BODY_DICTIONARY_DIR = os.getenv("MESSAGE_BODY_DICTIONARY_DIR", os.path.join(os.path.dirname(__file__), "dictionaries"))
+# Dictionary used to compress new bodies, plain zlib when not set
+MESSAGE_BODY_DICTIONARY_ID = os.getenv("MESSAGE_BODY_DICTIONARY_ID")
+
+_dictionaries: dict[str, bytes] = {}
+_dictionaries_lock = threading.Lock()
+
+
+def get_dictionary_id(dictionary: bytes) -> str:
+    """Get a short id identifying a dictionary"""
+    return hashlib.sha256(dictionary).hexdigest()[:12]
+
+
+def get_dictionary(dictionary_id: str, directory: str = MESSAGE_BODY_DICTIONARY_DIR) -> bytes:
+    """Load a dictionary from the registry by its id"""
+    with _dictionaries_lock:
+        if dictionary_id in _dictionaries:
+            return _dictionaries[dictionary_id]
+
+        path: str = os.path.join(directory, f"{dictionary_id}.dict")
+        if not os.path.exists(path):
+            raise ValueError(f"Message body dictionary {dictionary_id} is not in {directory}")
+
+        with open(path, "rb") as dictionary_file:
+            dictionary: bytes = dictionary_file.read()
+
+        if get_dictionary_id(dictionary) != dictionary_id:
+            raise ValueError(f"Message body dictionary {path} does not match its id")
+
+        _dictionaries[dictionary_id] = dictionary
+        return dictionary
+
+
+def save_dictionary(dictionary: bytes, directory: str = MESSAGE_BODY_DICTIONARY_DIR) -> str:
+    """Add a dictionary to the registry and return its id"""
+    dictionary_id: str = get_dictionary_id(dictionary)
+    os.makedirs(directory, exist_ok=True)
+    with open(os.path.join(directory, f"{dictionary_id}.dict"), "wb") as dictionary_file:
+        dictionary_file.write(dictionary)
+    return dictionary_id
+
+
+def train_dictionary(samples: Iterable[str], size: int = ZLIB_MAX_DICTIONARY_SIZE) -> bytes:
+    """
+    Build a preset dictionary from sample bodies.
+    Lines shared by many messages (footers, unsubscribe blocks, markup) are kept,
+    with the most common ones last since zlib matches closer content more cheaply.
+    """
+    line_counts: Counter = Counter()
+    for sample in samples:
+        line_counts.update(set(line.strip() for line in sample.splitlines() if len(line.strip()) > 8))
+
+    dictionary: bytes = b""
+    for line, count in line_counts.most_common():
+        if count < 2:
+            break
+        encoded_line: bytes = line.encode("utf-8") + b"\n"
+        if len(dictionary) + len(encoded_line) > size:
+            break
+        dictionary = encoded_line + dictionary
+
+    return dictionary
+
+
+class MessageBodyCodec:
+    """Compresses message bodies with zlib and an optional preset dictionary from the registry"""
+
+    def __init__(self, dictionary_id: str | None = MESSAGE_BODY_DICTIONARY_ID):
+        self._dictionary = get_dictionary(dictionary_id) if dictionary_id else None
+        self._codec_name = f"zlib:{dictionary_id}" if dictionary_id else "zlib"
+
+    @property
+    def codec_name(self) -> str:
+        """Name stored next to the compressed body"""
+        return self._codec_name
+
+    def compress(self, body: str) -> bytes:
+        """Compress a message body"""
+        compressor = zlib.compressobj(level=9, zdict=self._dictionary) if self._dictionary else zlib.compressobj(level=9)
+        return compressor.compress(body.encode("utf-8")) + compressor.flush()
+
+    @staticmethod
+    def decompress(data: bytes, codec_name: str) -> str:
+        """Decompress a message body with the codec and dictionary it was compressed with"""
+        if codec_name == "zlib":
+            return zlib.decompress(data).decode("utf-8")
+
+        algorithm, _, dictionary_id = codec_name.partition(":")
+        if algorithm != "zlib" or not dictionary_id:
+            raise ValueError(f"Unknown message body codec {codec_name}")
+
+        decompressor = zlib.decompressobj(zdict=get_dictionary(dictionary_id))
+        return (decompressor.decompress(data) + decompressor.flush()).decode("utf-8")
+
+
+_codec: MessageBodyCodec | None = None
+
+
+def get_codec() -> MessageBodyCodec:
+    """Get the codec compressing new bodies in this process"""
+    #pylint: disable=W0603
+    global _codec
+    if _codec is None:
+        _codec = MessageBodyCodec()
+    return _codec
+
+
+class LazyMessageBody:
+    """Compressed message body that is only decompressed when it is used"""
+
+    __slots__ = ("_data", "_codec_name", "_value")
+
+    def __init__(self, data: bytes, codec_name: str):
+        self._data = data
+        self._codec_name = codec_name
+        self._value: str | None = None
+
+    def __str__(self) -> str:
+        if self._value is None:
+            self._value = MessageBodyCodec.decompress(self._data, self._codec_name)
+        return self._value
+
+    def __repr__(self) -> str:
+        return f"LazyMessageBody(codec={self._codec_name}, size={len(self._data)})"
+
+
+class MessageItem(dict):
+    """
+    Message item whose compressed body is decompressed on first use.
+    Reading `message_body` by key only decompresses the body; any access to the item as a whole
+    (iteration, items(), values(), copies, comparison) replaces it with the plain string first,
+    so callers see the same item as for an uncompressed message.
+    """
+
+    def _materialize(self):
+        value = dict.get(self, BODY_ATTRIBUTE)
+        if isinstance(value, LazyMessageBody):
+            dict.__setitem__(self, BODY_ATTRIBUTE, str(value))
+
+    def __getitem__(self, key: Any) -> Any:
+        if key == BODY_ATTRIBUTE:
+            self._materialize()
+        return super().__getitem__(key)
+
+    def get(self, key: Any, default: Any = None) -> Any:
+        return self[key] if key in self else default
+
+    # Overriding __iter__ also makes dict(item), {**item} and update(item) go through keys() and __getitem__
+    def __iter__(self) -> Iterator:
+        self._materialize()
+        return super().__iter__()
+
+    def keys(self):
+        self._materialize()
+        return super().keys()
+
+    def items(self):
+        self._materialize()
+        return super().items()
+
+    def values(self):
+        self._materialize()
+        return super().values()
+
+    def pop(self, key: Any, *args: Any) -> Any:
+        self._materialize()
+        return super().pop(key, *args)
+
+    def popitem(self) -> tuple:
+        self._materialize()
+        return super().popitem()
+
+    def setdefault(self, key: Any, default: Any = None) -> Any:
+        self._materialize()
+        return super().setdefault(key, default)
+
+    def copy(self) -> "MessageItem":
+        self._materialize()
+        return MessageItem(super().copy())
+
+    def __eq__(self, other: object) -> bool:
+        self._materialize()
+        return super().__eq__(other)
+
+    def __repr__(self) -> str:
+        self._materialize()
+        return super().__repr__()
+
+
+def decode_message_item(item: dict | None) -> dict | None:
+    """Replace the compressed body attributes of an item with a lazily decompressed `message_body`"""
+    if item is None or COMPRESSED_BODY_ATTRIBUTE not in item:
+        return item
+
+    decoded_item = MessageItem(item)
+    data = dict.pop(decoded_item, COMPRESSED_BODY_ATTRIBUTE)
+    codec_name: str = dict.pop(decoded_item, BODY_CODEC_ATTRIBUTE, "zlib")
+    # boto3 returns binary attributes wrapped in boto3.dynamodb.types.Binary
+    data = data.value if hasattr(data, "value") else bytes(data)
+    dict.__setitem__(decoded_item, BODY_ATTRIBUTE, LazyMessageBody(data, codec_name))
+    return decoded_item
@@ -0,0 +1,43 @@
+"""Backfill of compressed message bodies"""
+
+import argparse
+from mcp_server.dynamodb import DynamoDbClient
+from mcp_server.message_body import MESSAGE_BODY_DICTIONARY_DIR, save_dictionary, train_dictionary
+from mcp_server.internal_logger import InternalLogger
+
+
+def handler(event, context):
+    """
+    Handler for running one segment of the backfill, e.g. {"segment": 0, "total_segments": 4}.
+    """
+
+    migrated: int = DynamoDbClient().compress_message_bodies(event.get("segment", 0), event.get("total_segments", 1))
+    InternalLogger.LogInfo(f"Compressed {migrated} message bodies")
+    return {"migrated": migrated}
+
+
+def main():
+    """Train the compression dictionary or run the backfill from the command line"""
+    parser = argparse.ArgumentParser(description="Compress stored message bodies")
+    parser.add_argument("--train-dictionary", action="store_true", help="Add a dictionary trained on stored bodies to the registry and exit")
+    parser.add_argument("--dictionary-dir", default=MESSAGE_BODY_DICTIONARY_DIR, help="Dictionary registry directory")
+    parser.add_argument("--samples", type=int, default=1000, help="Number of bodies to train the dictionary on")
+    parser.add_argument("--segment", type=int, default=0)
+    parser.add_argument("--total-segments", type=int, default=1)
+    args = parser.parse_args()
+
+    dynamo_db_client = DynamoDbClient()
+
+    if args.train_dictionary:
+        dictionary: bytes = train_dictionary(dynamo_db_client.sample_message_bodies(args.samples))
+        dictionary_id: str = save_dictionary(dictionary, args.dictionary_dir)
+        # Earlier dictionaries stay in the registry, items compressed with them still reference them by id
+        print(f"Added {len(dictionary)} byte dictionary {dictionary_id} to {args.dictionary_dir}, set MESSAGE_BODY_DICTIONARY_ID={dictionary_id} to use it")
+        return
+
+    migrated: int = dynamo_db_client.compress_message_bodies(args.segment, args.total_segments)
+    print(f"Compressed {migrated} message bodies")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,30 @@
+"""Pluggable metrics for model calls"""
+
+from typing import Callable
+from mcp_server.typings import CompletionMetrics
+from mcp_server.internal_logger import InternalLogger
+
+type MetricsHook = Callable[[CompletionMetrics], None]
+
+
+def log_metrics_hook(metrics: CompletionMetrics):
+    """Default hook that writes the metrics to the log"""
+    InternalLogger.LogInfo(f"Completion metrics: {metrics}")
+
+
+_metrics_hook: MetricsHook = log_metrics_hook
+
+
+def set_metrics_hook(hook: MetricsHook | None):
+    """Replace the hook receiving completion metrics, None restores the default"""
+    #pylint: disable=W0603
+    global _metrics_hook
+    _metrics_hook = hook or log_metrics_hook
+
+
+def record_completion_metrics(metrics: CompletionMetrics):
+    """Pass completion metrics to the hook, a failing hook never fails the call"""
+    try:
+        _metrics_hook(metrics)
+    except Exception as error: #pylint: disable=W0718
+        InternalLogger.LogError(f"Metrics hook failed: {error}")
@@ -5,7 +5,8 @@ from datetime import datetime
 import uuid
 import io
 from openai import OpenAI, Stream
-from openai.types.chat import ChatCompletionChunk
+from openai.types.chat import ChatCompletion, ChatCompletionChunk
+from openai.types import VectorStore
 from openai.types.vector_stores import VectorStoreFile
 
 class OpenAIClient:
@@ -30,6 +31,21 @@ class OpenAIClient:
 
         return response.choices[0].message.content
 
+    def get_structured_answer(self, context: str, query: str, schema_name: str, schema: dict, cache_key: str | None = None) -> ChatCompletion:
+        """
+        Get an answer constrained to a JSON schema.
+        `context` has to be static so that it forms a prefix the provider can cache.
+        """
+        return self.client.chat.completions.create(
+            model="gpt-4o-mini",
+            messages=[{"role": "developer", "content": context}, {"role": "user", "content": query}],
+            response_format={
+                "type": "json_schema",
+                "json_schema": {"name": schema_name, "schema": schema, "strict": True}
+            },
+            extra_body={"prompt_cache_key": cache_key} if cache_key else None,
+        )
+
     def upload_vector_store_file(self, file: tuple[str, io.BytesIO, str], purpose: str) -> VectorStoreFile:
         """Upload a vector store file to OpenAI"""
         return self.client.files.create(file=file, purpose=purpose)
@@ -42,6 +58,21 @@ class OpenAIClient:
         """Create a vector store file in OpenAI"""
         return self.client.vector_stores.files.create(vector_store_id=vector_store_id, file_id=file_id, attributes=attributes)
 
+    def create_vector_store(self, name: str, expires_after_days: int) -> VectorStore:
+        """Create a vector store in OpenAI that expires after being inactive for the given days"""
+        return self.client.vector_stores.create(
+            name=name,
+            expires_after={"anchor": "last_active_at", "days": expires_after_days}
+        )
+
+    def delete_vector_store_file(self, vector_store_id: str, file_id: str):
+        """Detach a file from a vector store in OpenAI"""
+        return self.client.vector_stores.files.delete(vector_store_id=vector_store_id, file_id=file_id)
+
+    def delete_file(self, file_id: str):
+        """Delete a file from OpenAI"""
+        return self.client.files.delete(file_id)
+
     def _get_prompt(self, today: str, timestamp: float) -> str:
         return f"""
             Use the provided mcp tools to answer the user's question.
@@ -54,3 +85,15 @@ class OpenAIClient:
             So for example if the user's question is "What is the weather in Tokyo today?", you should use the full day context by converting the current timestamp to timestamp of the beginning of the day.
             But if the user's question is "What is the weather in Tokyo at 10:00 AM?", you should use the time context.
         """
+
+
+_openai_client: OpenAIClient | None = None
+
+
+def get_openai_client() -> OpenAIClient:
+    """Get the OpenAI client shared by the whole process so its connection pool is reused"""
+    #pylint: disable=W0603
+    global _openai_client
+    if _openai_client is None:
+        _openai_client = OpenAIClient()
+    return _openai_client
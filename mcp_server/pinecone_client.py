@@ -2,29 +2,134 @@
 Pinecone client
 """
 
+from concurrent.futures import ThreadPoolExecutor
+import os
+import threading
+from typing import Any, Dict, List
 from pinecone import Pinecone, QueryResponse
-from mcp_server.open_ai_client import OpenAIClient
+from mcp_server.open_ai_client import OpenAIClient, get_openai_client
+from mcp_server.internal_logger import InternalLogger
+
+PINECONE_USE_GRPC = os.getenv("PINECONE_USE_GRPC", "false").lower() == "true"
+PINECONE_MAX_WORKERS = int(os.getenv("PINECONE_MAX_WORKERS", "8"))
+
+# Fetch ids travel in the URL, so they are kept well below the 1000 ids Pinecone accepts for delete
+PINECONE_FETCH_CHUNK_SIZE = 200
+PINECONE_DELETE_CHUNK_SIZE = 1000
+PINECONE_QUERY_IDS_CHUNK_SIZE = 1000
+
+_client: Pinecone | None = None
+_indexes: Dict[str, Any] = {}
+_lock = threading.Lock()
+
+
+def get_pinecone() -> Pinecone:
+    """Get the Pinecone client shared by the whole process, using gRPC when enabled and installed"""
+    #pylint: disable=W0603
+    global _client
+    with _lock:
+        if _client is None:
+            _client = _create_client()
+        return _client
+
+
+def _create_client() -> Pinecone:
+    if PINECONE_USE_GRPC:
+        try:
+            #pylint: disable=C0415
+            from pinecone.grpc import PineconeGRPC
+            return PineconeGRPC()
+        except ImportError:
+            InternalLogger.LogError("PINECONE_USE_GRPC is set but pinecone[grpc] is not installed, falling back to HTTP")
+    return Pinecone()
+
+
+def get_index(index_name: str):
+    """Get the cached index handle, which keeps its resolved host and connection pool"""
+    index = _indexes.get(index_name)
+    if index is not None:
+        return index
+
+    pinecone = get_pinecone()
+    with _lock:
+        if index_name not in _indexes:
+            _indexes[index_name] = pinecone.Index(index_name)
+        return _indexes[index_name]
+
+
+def _chunks(ids: List[str], size: int) -> List[List[str]]:
+    return [ids[i:i + size] for i in range(0, len(ids), size)]
+
 
 class PineconeClient:
     """Pinecone client"""
 
     __openai_client: OpenAIClient
-    __client: Pinecone
     def __init__(self):
-        self.__openai_client = OpenAIClient()
-        self.__client = Pinecone()
+        self.__openai_client = get_openai_client()
 
     def get_index(self, index_name: str):
         """Get the index"""
-        return self.__client.Index(index_name)
+        return get_index(index_name)
 
     def search(self, index_name: str, namespace: str, query: str, top_k: int = 10, additional_filters: dict = {}) -> QueryResponse:
         """Search the index"""
         index = self.get_index(index_name)
         embedded_query = self.__openai_client.create_embedding(query)
         return index.query(namespace=namespace, vector=embedded_query, top_k=top_k, filter=additional_filters)
-    
+
+    def search_in_ids(self, index_name: str, namespace: str, query: str, ids: List[str], top_k: int = 10, additional_filters: dict | None = None) -> List[Any]:
+        """
+        Search only among the given ids.
+        Large id lists are split into several concurrent queries whose matches are merged by score.
+        """
+        if not ids:
+            return []
+
+        additional_filters = additional_filters or {}
+        index = self.get_index(index_name)
+        embedded_query = self.__openai_client.create_embedding(query)
+
+        def query_chunk(chunk: List[str]) -> QueryResponse:
+            chunk_filter: dict = {**additional_filters, "vector_id": {"$in": chunk}}
+            return index.query(namespace=namespace, vector=embedded_query, top_k=min(top_k, len(chunk)), filter=chunk_filter)
+
+        chunks: List[List[str]] = _chunks(ids, PINECONE_QUERY_IDS_CHUNK_SIZE)
+        if len(chunks) == 1:
+            return list(query_chunk(chunks[0]).matches)
+
+        with ThreadPoolExecutor(max_workers=PINECONE_MAX_WORKERS) as executor:
+            responses: List[QueryResponse] = list(executor.map(query_chunk, chunks))
+
+        matches: List[Any] = [match for response in responses for match in response.matches]
+        return sorted(matches, key=lambda match: match.score, reverse=True)[:top_k]
+
+    def fetch_many(self, index_name: str, namespace: str, ids: List[str]) -> Dict[str, Any]:
+        """Fetch vectors by id, fetching chunks of ids concurrently"""
+        if not ids:
+            return {}
+
+        index = self.get_index(index_name)
+
+        with ThreadPoolExecutor(max_workers=PINECONE_MAX_WORKERS) as executor:
+            responses = list(executor.map(lambda chunk: index.fetch(ids=chunk, namespace=namespace), _chunks(ids, PINECONE_FETCH_CHUNK_SIZE)))
+
+        vectors: Dict[str, Any] = {}
+        for response in responses:
+            vectors.update(response.vectors)
+        return vectors
+
+    def delete_many(self, index_name: str, namespace: str, ids: List[str]):
+        """Delete vectors by id, deleting chunks of ids concurrently"""
+        if not ids:
+            return
+
+        index = self.get_index(index_name)
+
+        with ThreadPoolExecutor(max_workers=PINECONE_MAX_WORKERS) as executor:
+            list(executor.map(lambda chunk: index.delete(ids=chunk, namespace=namespace), _chunks(ids, PINECONE_DELETE_CHUNK_SIZE)))
+
     def delete_message_by_id(self, index_name: str, namespace: str, message_id: str):
         """Delete a message by id"""
         index = self.get_index(index_name)
-        index.delete(namespace=namespace, ids=[message_id])
\ No newline at end of file
+        index.delete(namespace=namespace, ids=[message_id])
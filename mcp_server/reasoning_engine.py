@@ -5,123 +5,110 @@ Reasoning engine
 from datetime import datetime
 import json
 import os
+import time
 from typing import Literal
 
-from openai import OpenAI
-import dateutil.parser
-from mcp_server.models import QueryFilter
-from mcp_server.open_ai_client import OpenAIClient
-
-from boto3.dynamodb.conditions import Key, Attr
+from openai.types.chat import ChatCompletion
+from mcp_server.open_ai_client import OpenAIClient, get_openai_client
+from mcp_server.metrics import record_completion_metrics
+from mcp_server.internal_logger import InternalLogger
 
+# Kept as the first message and never templated so that it is a cacheable prompt prefix
 REASONING_PROMPT_PINECONE = os.getenv("REASONING_PROMPT_PINECONE")
 
-pinecone_filter_valid_strings = Literal["$lte", "$gte", "$eq", "$ne", "$gt", "$lt"]
-pinecone_to_dynamodb_mapping: dict = {
-    "$lte": "lte",
-    "$gte": "gte",
-    "$eq": "eq",
-    "$ne": "ne",
-    "$gt": "gt",
-    "$lt": "lt"
+pinecone_filter_valid_strings = Literal["$lte", "$gte", "$eq", "$gt", "$lt"]
+
+# Dates are requested as dd/mm/yyyy and parsed with exactly that format, never guessed
+REASONING_DATE_FORMAT = "%d/%m/%Y"
+reasoning_date_pattern = r"^(0[1-9]|[12][0-9]|3[01])/(0[1-9]|1[0-2])/[0-9]{4}$"
+
+reasoning_response_schema: dict = {
+    "type": "object",
+    "properties": {
+        "filtering_by_date": {"type": "boolean"},
+        "is_asking_about_specific_details": {"type": "boolean"},
+        "date": {
+            "type": "object",
+            "properties": {
+                operator: {"anyOf": [{"type": "string", "pattern": reasoning_date_pattern, "description": "Day as dd/mm/yyyy"}, {"type": "null"}]}
+                for operator in pinecone_filter_valid_strings.__args__
+            },
+            "required": list(pinecone_filter_valid_strings.__args__),
+            "additionalProperties": False
+        }
+    },
+    "required": ["filtering_by_date", "is_asking_about_specific_details", "date"],
+    "additionalProperties": False
 }
 
-local_secondary_index_column_name = "created_at_timestamp"
-
 class ReasoningEngine:
     """Reasoning engine"""
 
     __openai_client: OpenAIClient
 
     def __init__(self):
-        self.__openai_client = OpenAIClient()
+        self.__openai_client = get_openai_client()
 
-    def get_additional_filters(self, user_input: str) -> list[str]:
+    def get_additional_filters(self, user_input: str) -> dict:
         """Get additional filters"""
         user_input = user_input + " Current date: " + datetime.now().strftime("%d/%m/%Y %H:%M")
-        response: str = self.__openai_client.get_answer(REASONING_PROMPT_PINECONE, user_input)
 
-        converted_response: dict = self.__parse_response(response)
-        valid: bool = self.__validate_response(converted_response)
-        return self.__convert_to_timestamp(converted_response) if valid else {}
+        started_at: float = time.perf_counter()
+        completion: ChatCompletion = self.__openai_client.get_structured_answer(
+            REASONING_PROMPT_PINECONE,
+            user_input,
+            "reasoning_filters",
+            reasoning_response_schema,
+            cache_key="reasoning_filters"
+        )
+        latency_ms: float = (time.perf_counter() - started_at) * 1000
+
+        converted_response: dict = self.__parse_response(completion)
+        self.__record_metrics(completion, latency_ms, parsed=bool(converted_response))
+
+        return self.__convert_to_timestamp(converted_response) if converted_response else {}
+
+    def __parse_response(self, completion: ChatCompletion) -> dict:
+        message = completion.choices[0].message
+        if message.refusal or not message.content:
+            InternalLogger.LogError(f"Reasoning response refused: {message.refusal}")
+            return {}
 
-    def __parse_response(self, response: str) -> list[str]:
         try:
-            return json.loads(response)
+            return json.loads(message.content)
         except json.JSONDecodeError:
-            print(f"Error parsing response: {response}")
+            InternalLogger.LogError(f"Error parsing response: {message.content}")
             return {}
-    
-    def __validate_response(self, response: dict) -> bool:
-        has_date = "date" in response
-        is_dict = isinstance(response.get("date"), dict)
-        valid_keys = all(key in pinecone_filter_valid_strings.__args__ for key in response.get("date", {}).keys())
-        return has_date and is_dict and valid_keys
-    
-    def __convert_to_timestamp(self, response: dict) -> list[str]:
-        for date_str in response.get("date", {}).keys():
-            _value = response.get("date", {})[date_str]
-            _date = dateutil.parser.parse(_value, dayfirst=True)
-            response.get("date", {})[date_str] = int(_date.timestamp())
 
+    def __convert_to_timestamp(self, response: dict) -> dict:
+        date_filters: dict = {}
+        for operator, value in (response.get("date") or {}).items():
+            if value is None:
+                continue
+            try:
+                date_filters[operator] = int(datetime.strptime(value, REASONING_DATE_FORMAT).timestamp())
+            except ValueError:
+                InternalLogger.LogError(f"Error parsing date {operator}: {value}")
+
+        if not date_filters:
+            # Without usable bounds a date filtered query would read the whole mailbox
+            response.pop("date", None)
+            response["filtering_by_date"] = False
+            return response
+
+        response["date"] = date_filters
         return response
-    
-    @staticmethod
-    def convert_pinecone_filter_to_dynamodb_filter(filter: dict | None, ui_filter: QueryFilter | None = None) -> Attr | None:
-        """Convert Pinecone filter to DynamoDB filter"""
-        if not filter and not ui_filter:
-            return None
-        
-        date_relative_filter: Attr | None = None
-        is_ui_filtering_by_date: bool = ui_filter and (ui_filter.start_date or ui_filter.end_date)
-
-        # Handle reasoning filter if not filtering by date explicitly from UI
-        if filter and 'date' in filter and not is_ui_filtering_by_date:
-            date_filters = filter['date']
-            gte = date_filters.get('$gte', None)
-            lte = date_filters.get('$lte', int(datetime.now().timestamp()))
-            
-            if all([gte, lte]):
-                date_relative_filter = Attr(local_secondary_index_column_name).between(gte, lte)
-
-        # Handle UI filter
-        if ui_filter:
-            ui_dynamo_filter = PineconeFilterConverter.convert_ui_filter_to_dynamodb_filter(ui_filter, is_ui_filtering_by_date)
-            if ui_dynamo_filter:
-                if date_relative_filter:
-                    date_relative_filter = date_relative_filter & ui_dynamo_filter
-                else:
-                    date_relative_filter = ui_dynamo_filter
-
-        return date_relative_filter
-
-class PineconeFilterConverter:
+
     @staticmethod
-    def convert_ui_filter_to_dynamodb_filter(ui_filter: QueryFilter, is_ui_filtering_by_date: bool) -> Attr | None:
-        ddb_filter: Attr | None = None
-
-        if ui_filter.inboxes and len(list(filter(lambda x: x != "ALL", ui_filter.inboxes))) > 0:
-            if ddb_filter:
-                ddb_filter = ddb_filter & Attr("provided_key").contains(ui_filter.inboxes)
-            else:
-                ddb_filter = Attr("provided_key").contains(ui_filter.inboxes)
-
-        if ui_filter.start_date and ui_filter.end_date and is_ui_filtering_by_date:
-            if ddb_filter:
-                ddb_filter = ddb_filter & Attr("created_at_timestamp").between(ui_filter.start_date_timestamp(), ui_filter.end_date_timestamp())
-            else:
-                ddb_filter = Attr("created_at_timestamp").between(ui_filter.start_date_timestamp(), ui_filter.end_date_timestamp())
-        else:
-            if ui_filter.start_date and is_ui_filtering_by_date:
-                if ddb_filter:
-                    ddb_filter = ddb_filter & Attr("created_at_timestamp").gte(ui_filter.start_date_timestamp())
-                else:
-                    ddb_filter = Attr("created_at_timestamp").gte(ui_filter.start_date_timestamp())
-
-            if ui_filter.end_date and is_ui_filtering_by_date:
-                if ddb_filter:
-                    ddb_filter = ddb_filter & Attr("created_at_timestamp").lte(ui_filter.end_date_timestamp())
-                else:
-                    ddb_filter = Attr("created_at_timestamp").lte(ui_filter.end_date_timestamp())
-
-        return ddb_filter
\ No newline at end of file
+    def __record_metrics(completion: ChatCompletion, latency_ms: float, parsed: bool):
+        usage = completion.usage
+        prompt_tokens_details = getattr(usage, "prompt_tokens_details", None) if usage else None
+        record_completion_metrics({
+            "operation": "reasoning_filters",
+            "model": completion.model,
+            "prompt_tokens": usage.prompt_tokens if usage else 0,
+            "cached_tokens": (prompt_tokens_details.cached_tokens or 0) if prompt_tokens_details else 0,
+            "completion_tokens": usage.completion_tokens if usage else 0,
+            "latency_ms": latency_ms,
+            "parsed": parsed
+        })
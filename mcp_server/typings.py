@@ -2,3 +2,14 @@ from typing import TypedDict
 
 
 VectorStoreAttributes = TypedDict("attributes", {"request_id": str})
+
+
+CompletionMetrics = TypedDict("CompletionMetrics", {
+    "operation": str,
+    "model": str,
+    "prompt_tokens": int,
+    "cached_tokens": int,
+    "completion_tokens": int,
+    "latency_ms": float,
+    "parsed": bool
+})
@@ -0,0 +1,70 @@
+"""Per-user vector store management"""
+
+import os
+import time
+from mcp_server.cache import TTLCache
+from mcp_server.dynamodb import DynamoDbClient
+from mcp_server.open_ai_client import OpenAIClient, get_openai_client
+from mcp_server.internal_logger import InternalLogger
+
+VECTOR_STORE_EXPIRES_AFTER_DAYS = int(os.getenv("VECTOR_STORE_EXPIRES_AFTER_DAYS", "1"))
+
+vector_store_ids_cache = TTLCache(max_size=1024, ttl=300)
+
+
+class VectorStoreManager:
+    """Creates or reuses an ephemeral vector store per user or session"""
+
+    def __init__(self, dynamo_db_client: DynamoDbClient | None = None, openai_client: OpenAIClient | None = None):
+        self._dynamo_db_client = dynamo_db_client or DynamoDbClient()
+        self._openai_client = openai_client or get_openai_client()
+
+    def get_vector_store_id(self, scope_key: str) -> str:
+        """Get the id of the vector store for the user or session, creating it if needed"""
+        assert scope_key is not None, "scope_key is required"
+
+        # Without a mapping table every upload keeps going to the shared vector store
+        if not os.getenv("USER_VECTOR_STORES_TABLE_NAME"):
+            vector_store_id: str | None = os.getenv("VECTOR_STORE_ID")
+            assert vector_store_id is not None, "VECTOR_STORE_ID is not set"
+            return vector_store_id
+
+        cached_vector_store_id: str | None = vector_store_ids_cache.get(scope_key)
+        if cached_vector_store_id is not None:
+            return cached_vector_store_id
+
+        now: int = int(time.time())
+        expires_after: int = VECTOR_STORE_EXPIRES_AFTER_DAYS * 24 * 60 * 60
+        mapping: dict | None = self._dynamo_db_client.get_user_vector_store(scope_key)
+
+        if mapping is None or int(mapping["expires_at"]) <= now:
+            return self.__create_vector_store(scope_key)
+
+        vector_store_id: str = mapping["vector_store_id"]
+
+        # The store expires relative to its last activity, so keep the mapping ahead of it
+        if int(mapping["expires_at"]) - now < expires_after / 2:
+            self._dynamo_db_client.put_user_vector_store(scope_key, vector_store_id, now + expires_after)
+
+        vector_store_ids_cache.set(scope_key, vector_store_id)
+        return vector_store_id
+
+    def recreate_vector_store(self, scope_key: str) -> str:
+        """Replace a vector store that expired or was deleted before its mapping"""
+        vector_store_ids_cache.invalidate(scope_key)
+        return self.__create_vector_store(scope_key)
+
+    def __create_vector_store(self, scope_key: str) -> str:
+        InternalLogger.LogDebug(f"Creating vector store for {scope_key}")
+
+        vector_store_id: str = self._openai_client.create_vector_store(
+            name=f"ig-gmail-mcp-{scope_key}",
+            expires_after_days=VECTOR_STORE_EXPIRES_AFTER_DAYS
+        ).id
+
+        expires_at: int = int(time.time()) + VECTOR_STORE_EXPIRES_AFTER_DAYS * 24 * 60 * 60
+        self._dynamo_db_client.put_user_vector_store(scope_key, vector_store_id, expires_at)
+        vector_store_ids_cache.set(scope_key, vector_store_id)
+
+        InternalLogger.LogDebug(f"Vector store {vector_store_id} created for {scope_key}")
+        return vector_store_id